@@ -1,62 +1,176 @@
+import asyncio
+import contextlib
+import hashlib
 import os
-import subprocess
+import stat
+import sys
 import json
+import logging
 from pathlib import Path
 
+import httpx
+import ollama
 
-def get_directory_structure(root_dir):
-    """Get the directory structure starting from root_dir"""
-    dir_structure = {}
+try:
+    import orjson
+except ImportError:  # Fall back to the standard json module
+    orjson = None
 
-    for root, dirs, files in os.walk(root_dir):
-        # Skip hidden directories and files
-        dirs[:] = [d for d in dirs if not d.startswith(".")]
-        files = [f for f in files if not f.startswith(".")]
+MODEL = "deepseek-v3.1:671b-cloud"
+BATCH_SEPARATOR = "---DOCBREAK---"
+IGNORE_DIRS = frozenset({"docs", ".git", "__pycache__", ".venv", "node_modules"})
 
-        dirs[:] = [d for d in dirs if not d.startswith("docs")]
+log = logging.getLogger("docgen")
 
-        rel_path = os.path.relpath(root, root_dir)
-        if rel_path == ".":
-            rel_path = ""
 
-        dir_structure[rel_path] = {
-            "subdirs": [os.path.join(rel_path, d) for d in dirs] if rel_path else dirs,
-            "files": files,
-        }
+def json_loads(data):
+    """Parse JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
-    return dir_structure
 
+def json_dumps(obj):
+    """Serialize obj to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
 
-def get_directory_content(root_dir, dir_path):
-    """Get content information about a specific directory"""
-    full_path = os.path.join(root_dir, dir_path) if dir_path else root_dir
 
-    content_info = {
-        "path": dir_path if dir_path else "root",
-        "files": [],
-        "subdirectories": [],
-        "file_extensions": set(),
-    }
+def get_write_target(path):
+    """Get the file to write through symlinks and the mode it should keep"""
+    # Write through symlinks (e.g. dotfile managers) and keep the file mode
+    path = os.path.realpath(path)
+    try:
+        return path, stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return path, 0o644
+
+
+def write_all(fd, data):
+    """Write all of data to the file descriptor"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def atomic_write_bytes(path, data, mode=None):
+    """Write data to path through a temporary file replaced in one step"""
+    path, current_mode = get_write_target(path)
+    if mode is None:
+        mode = current_mode
+
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        try:
+            write_all(fd, data)
+        finally:
+            os.close(fd)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Don't leave a partial temporary file behind
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def get_env_int(name, default):
+    """Read a positive integer setting from the environment"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
 
     try:
-        for item in os.listdir(full_path):
-            if item.startswith("."):
-                continue
+        return max(1, int(value))
+    except ValueError:
+        log.warning(f"Ignoring invalid {name}={value!r}, using {default}")
+        return default
 
-            item_path = os.path.join(full_path, item)
-            if os.path.isfile(item_path):
-                content_info["files"].append(item)
-                ext = os.path.splitext(item)[1]
-                if ext:
-                    content_info["file_extensions"].add(ext)
-            elif os.path.isdir(item_path):
-                content_info["subdirectories"].append(item)
 
-        content_info["file_extensions"] = list(content_info["file_extensions"])
-    except PermissionError:
-        print(f"Permission denied accessing {full_path}")
+def create_client():
+    """Create the Ollama client, reusing keep-alive connections across requests"""
+    return ollama.AsyncClient(
+        timeout=httpx.Timeout(300.0, connect=10.0),
+        limits=httpx.Limits(
+            max_keepalive_connections=40,
+            max_connections=100,
+            keepalive_expiry=30.0,
+        ),
+    )
 
-    return content_info
+
+def walk_directories(root_dir, onerror=None):
+    """Walk root_dir top-down, yielding (root, dirs, files, dirfd)"""
+    # os.fwalk lists each level through an open directory fd instead of
+    # re-resolving the full path; dirfd is None when falling back to os.walk
+    if hasattr(os, "fwalk"):
+        yield from os.fwalk(root_dir, onerror=onerror)
+    else:
+        for root, dirs, files in os.walk(root_dir, onerror=onerror):
+            yield root, dirs, files, None
+
+
+def get_last_modified(root, files, dirfd):
+    """Get the latest modification time of a directory and its files"""
+    # Stat relative to the directory fd when walking with os.fwalk
+    if dirfd is not None:
+        mtimes = [os.fstat(dirfd).st_mtime]
+    else:
+        mtimes = [os.stat(root).st_mtime]
+
+    for f in files:
+        path = f if dirfd is not None else os.path.join(root, f)
+        try:
+            mtimes.append(os.stat(path, dir_fd=dirfd, follow_symlinks=False).st_mtime)
+        except OSError:
+            continue
+
+    return max(mtimes)
+
+
+# Shared extension strings, so every directory reuses the same ".py" object
+_EXT_INTERN = {}
+
+
+def intern_extension(ext):
+    """Get the shared string object for a file extension"""
+    return _EXT_INTERN.setdefault(ext, sys.intern(ext))
+
+
+def get_directory_structure(root_dir, ignore_dirs=IGNORE_DIRS):
+    """Get the content information of every directory starting from root_dir"""
+    dir_structure = {}
+
+    def on_error(error):
+        if isinstance(error, PermissionError):
+            log.warning(f"Permission denied accessing {error.filename}")
+
+    for root, dirs, files, dirfd in walk_directories(root_dir, onerror=on_error):
+        # Skip ignored and hidden directories and files
+        dirs[:] = [d for d in dirs if d not in ignore_dirs and not d.startswith(".")]
+        files = [f for f in files if f not in ignore_dirs and not f.startswith(".")]
+
+        rel_path = os.path.relpath(root, root_dir)
+        if rel_path == ".":
+            rel_path = ""
+
+        extensions = set()
+        for f in files:
+            ext = os.path.splitext(f)[1]
+            if ext:
+                extensions.add(intern_extension(ext))
+
+        dir_structure[rel_path] = {
+            "path": rel_path if rel_path else "root",
+            "files": files,
+            "subdirectories": list(dirs),
+            "file_extensions": sorted(extensions),
+            "mtime": get_last_modified(root, files, dirfd),
+        }
+
+    return dir_structure
 
 
 def generate_prompt(directory_info, root_dir_name):
@@ -87,96 +201,388 @@ Format the response as clean markdown without any introductory text or code bloc
     return prompt
 
 
-def call_ollama(prompt):
-    """Call Ollama CLI with the given prompt"""
+def generate_batch_prompt(directory_infos, root_dir_name):
+    """Generate a single prompt documenting several directories at once"""
+    sections = []
+    for directory_info in directory_infos:
+        path = directory_info["path"]
+        files = directory_info["files"]
+        subdirs = directory_info["subdirectories"]
+        extensions = directory_info["file_extensions"]
+
+        sections.append(f"""### DIR: {path}
+- Files: {', '.join(files) if files else 'None'}
+- Subdirectories: {', '.join(subdirs) if subdirs else 'None'}
+- File extensions present: {', '.join(extensions) if extensions else 'None'}""")
+
+    directories = "\n\n".join(sections)
+
+    prompt = f"""Generate comprehensive documentation for each of the following {len(directory_infos)} directories in the project '{root_dir_name}'.
+
+{directories}
+
+For each directory, create a detailed markdown documentation that includes:
+1. Purpose and functionality of this directory
+2. Overview of files and their roles
+3. Subdirectories and their purposes
+4. How this directory interacts with other parts of the project
+5. Any important configuration or setup information
+6. Usage examples if applicable
+
+Write the documentations in the same order as the directories above and separate them with a line containing only {BATCH_SEPARATOR}. Do not repeat the '### DIR:' headers.
+Format each documentation as clean markdown without any introductory text or code blocks. Start directly with the content."""
+
+    return prompt
+
+
+def get_doc_file_path(docs_dir, dir_path):
+    """Get the documentation file of a directory"""
+    if dir_path:  # Not root directory
+        return os.path.join(docs_dir, dir_path, "README.md")
+    else:  # Root directory
+        return os.path.join(docs_dir, "README.md")
+
+
+def log_ollama_error(error):
+    """Log an error raised while calling Ollama"""
+    if isinstance(error, ollama.ResponseError):
+        log.error(f"Ollama error: {error.error}")
+    else:
+        log.error(f"Error calling Ollama: {error}")
+
+
+async def call_ollama_async(client, prompt, **kwargs):
+    """Call Ollama through the async client with the given prompt"""
     try:
-        # Call Ollama via CLI
-        result = subprocess.run(
-            [
-                "ollama",
-                "run",
-                "deepseek-v3.1:671b-cloud",
-                "--keepalive",
-                "15m",
-                "--hidethinking",
-            ],
-            input=prompt,
-            capture_output=True,
-            text=True,
+        response = await client.generate(
+            model=MODEL, prompt=prompt, keep_alive="15m", **kwargs
         )
+        return response["response"].strip()
 
-        if result.returncode == 0:
-            return result.stdout.strip()
-        else:
-            print(f"Ollama error: {result.stderr}")
-            return None
-
-    except subprocess.TimeoutExpired:
-        print("Ollama request timed out")
+    except Exception as e:
+        log_ollama_error(e)
         return None
+
+
+def open_temp_file(path):
+    """Create the parent folder of path and open a temporary file to replace it"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    target_path, mode = get_write_target(path)
+    tmp_path = f"{target_path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    return fd, tmp_path, target_path, mode
+
+
+def commit_temp_file(fd, tmp_path, path, mode):
+    """Close the temporary file and move it over path"""
+    try:
+        os.close(fd)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def discard_temp_file(fd, tmp_path):
+    """Close and remove a temporary file that won't be used"""
+    os.close(fd)
+    with contextlib.suppress(OSError):
+        os.remove(tmp_path)
+
+
+async def stream_ollama_to_file(client, prompt, doc_file_path):
+    """Stream the Ollama response for the prompt into doc_file_path"""
+    fd = None
+    failed = False
+    save_error = None
+    parts = []
+    # Whitespace is held back until more text follows so the saved file is stripped
+    pending = ""
+
+    # File operations run in a worker thread so writing never blocks the other
+    # streams sharing the event loop
+    try:
+        stream = await client.generate(
+            model=MODEL, prompt=prompt, keep_alive="15m", stream=True
+        )
+        async for chunk in stream:
+            text = pending + chunk["response"]
+            if not parts:
+                text = text.lstrip()
+            stripped = text.rstrip()
+            pending = text[len(stripped) :]
+            if stripped:
+                try:
+                    if fd is None:
+                        # Only create the docs folder once there is content to save
+                        fd, tmp_path, target_path, mode = await asyncio.to_thread(
+                            open_temp_file, doc_file_path
+                        )
+                    await asyncio.to_thread(write_all, fd, stripped.encode("utf-8"))
+                except OSError as e:
+                    save_error = e
+                    break
+                parts.append(stripped)
+        if save_error is not None:
+            await stream.aclose()
+
     except Exception as e:
-        print(f"Error calling Ollama: {e}")
+        log_ollama_error(e)
+        failed = True
+
+    if save_error is not None:
+        log.error(f"Error saving {doc_file_path}: {save_error}")
+        failed = True
+    if failed:
+        if fd is not None:
+            await asyncio.to_thread(discard_temp_file, fd, tmp_path)
         return None
+    if fd is None:
+        return None
+
+    try:
+        await asyncio.to_thread(commit_temp_file, fd, tmp_path, target_path, mode)
+    except OSError as e:
+        log.error(f"Error saving {doc_file_path}: {e}")
+        return None
+
+    log.info(f"Documentation saved: {doc_file_path}")
+    return "".join(parts)
+
+
+def is_documentation_up_to_date(doc_file_path, mtime):
+    """Check whether the documentation file is newer than the given mtime"""
+    try:
+        return os.path.getmtime(doc_file_path) >= mtime
+    except OSError:
+        return False
 
 
 def save_documentation(docs_dir, dir_path, content):
     """Save the generated documentation to the appropriate location"""
-    if dir_path:  # Not root directory
-        doc_dir_path = os.path.join(docs_dir, dir_path)
-        os.makedirs(doc_dir_path, exist_ok=True)
-        doc_file_path = os.path.join(doc_dir_path, "README.md")
-    else:  # Root directory
-        doc_file_path = os.path.join(docs_dir, "README.md")
+    doc_file_path = get_doc_file_path(docs_dir, dir_path)
+    os.makedirs(os.path.dirname(doc_file_path), exist_ok=True)
 
-    with open(doc_file_path, "w", encoding="utf-8") as f:
-        f.write(content)
+    atomic_write_bytes(doc_file_path, content.encode("utf-8"))
 
-    print(f"Documentation saved: {doc_file_path}")
+    log.info(f"Documentation saved: {doc_file_path}")
 
 
-def main():
-    # Configuration
-    root_dir = "."  # Current directory
-    docs_dir = "./docs"
+def get_prompt_cache_key(prompt):
+    """Get the cache key of a prompt for the configured model"""
+    return hashlib.blake2b(f"{MODEL}\n{prompt}".encode("utf-8")).hexdigest()
 
-    # Create docs directory if it doesn't exist
-    os.makedirs(docs_dir, exist_ok=True)
 
-    # Get project name from root directory
-    root_dir_name = os.path.basename(os.path.abspath(root_dir))
+def load_prompt_cache(cache_path):
+    """Load the cached Ollama responses keyed by prompt hash"""
+    try:
+        with open(cache_path, "rb") as f:
+            return json_loads(f.read())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log.warning(f"Ignoring unreadable prompt cache {cache_path}: {e}")
+        return {}
 
-    # Get directory structure
-    print("Scanning directory structure...")
-    dir_structure = get_directory_structure(root_dir)
 
-    # Process each directory
-    for dir_path in dir_structure.keys():
-        print(f"\nProcessing directory: {dir_path if dir_path else 'root'}")
+def save_prompt_cache(cache_path, cache):
+    """Persist the cached Ollama responses"""
+    atomic_write_bytes(cache_path, json_dumps(cache))
+
+
+async def warm_up_model(client):
+    """Load the model on the Ollama server, returning whether it succeeded"""
+    response = await call_ollama_async(client, "ok", options={"num_predict": 1})
+    return response is not None
+
+
+async def process_dir(client, semaphore, docs_dir, dir_path, prompt):
+    """Generate the documentation for a single directory"""
+    doc_file_path = get_doc_file_path(docs_dir, dir_path)
+
+    # Stream the Ollama response into the documentation file, bounded by the semaphore
+    async with semaphore:
+        log.info(f"Generating documentation for: {dir_path if dir_path else 'root'}")
+        documentation = await stream_ollama_to_file(client, prompt, doc_file_path)
+
+    return dir_path, documentation
+
 
-        # Get directory content
-        dir_info = get_directory_content(root_dir, dir_path)
+async def process_batch(client, semaphore, docs_dir, batch, root_dir_name):
+    """Generate the documentation for a batch of (dir_path, dir_info, prompt)"""
+    # Returns (dir_path, documentation, streamed) results, where streamed tells
+    # whether the documentation was already written to its file
+    # A single directory keeps its own prompt and is streamed to its file
+    if len(batch) == 1:
+        dir_path, _, prompt = batch[0]
+        dir_path, documentation = await process_dir(
+            client, semaphore, docs_dir, dir_path, prompt
+        )
+        return [(dir_path, documentation, True)]
+
+    dir_paths = [dir_path for dir_path, _, _ in batch]
+    prompt = generate_batch_prompt(
+        [dir_info for _, dir_info, _ in batch], root_dir_name
+    )
 
-        # Generate prompt
-        prompt = generate_prompt(dir_info, root_dir_name)
+    async with semaphore:
+        log.info(
+            f"Generating documentation for: {', '.join(p or 'root' for p in dir_paths)}"
+        )
+        response = await call_ollama_async(client, prompt)
+
+    # A failed request fails the whole batch without retrying every directory
+    if not response:
+        return [(dir_path, None, True) for dir_path in dir_paths]
+
+    # Ignore empty pieces, such as the one after a trailing separator
+    documentations = [d.strip() for d in response.split(BATCH_SEPARATOR)]
+    documentations = [d for d in documentations if d]
+    if len(documentations) == len(batch):
+        return [(p, d, False) for p, d in zip(dir_paths, documentations)]
+
+    # Keep the documents that line up with the first directories and generate
+    # the missing ones one by one; with too many pieces none of them can be matched
+    kept = documentations if len(documentations) < len(batch) else []
+    log.warning(
+        f"Expected {len(batch)} documentations but got {len(documentations)}, "
+        f"generating {len(batch) - len(kept)} of them one by one"
+    )
+    results = [(p, d, False) for p, d in zip(dir_paths, kept)]
+    retried = await asyncio.gather(
+        *(
+            process_dir(client, semaphore, docs_dir, dir_path, prompt)
+            for dir_path, _, prompt in batch[len(kept) :]
+        )
+    )
+    results.extend((p, d, True) for p, d in retried)
+    return results
 
-        # Call Ollama to generate documentation
-        print("Generating documentation with Ollama...")
-        documentation = call_ollama(prompt)
 
-        if documentation:
-            # Save documentation
-            save_documentation(docs_dir, dir_path, documentation)
-            print("✓ Documentation generated successfully")
-        else:
-            print("✗ Failed to generate documentation")
+async def main():
+    # Configuration
+    root_dir = "."  # Current directory
+    docs_dir = "./docs"
+    parallel = get_env_int("OLLAMA_NUM_PARALLEL", 4)
+    batch_size = get_env_int("DOCGEN_BATCH_SIZE", 8)
+
+    log.info(
+        f"Sending up to {parallel} concurrent requests. Start the Ollama server with "
+        f"OLLAMA_NUM_PARALLEL={parallel} to serve them without queuing."
+    )
 
-        # Add a small delay to be respectful to the API
-        import time
+    # Create docs directory if it doesn't exist
+    os.makedirs(docs_dir, exist_ok=True)
 
-        time.sleep(1)
+    # Get project name from root directory
+    root_dir_name = os.path.basename(os.path.abspath(root_dir))
 
-    print(f"\nDocumentation generation complete! All files saved in {docs_dir}")
+    # Get directory structure
+    log.info("Scanning directory structure...")
+    # Never document the generated docs themselves
+    ignore_dirs = IGNORE_DIRS | {os.path.basename(os.path.normpath(docs_dir))}
+    dir_structure = get_directory_structure(root_dir, ignore_dirs)
+
+    # Skip directories not modified since their documentation was written and
+    # reuse the documentation of directories whose prompt did not change
+    cache_path = Path(docs_dir) / ".prompt_cache.json"
+    previous_cache = load_prompt_cache(cache_path)
+    cache = {}
+    keys = {}
+    pending = []
+    # Persist the documents generated so far even if the run stops early
+    try:
+        for dir_path, dir_info in dir_structure.items():
+            prompt = generate_prompt(dir_info, root_dir_name)
+            key = get_prompt_cache_key(prompt)
+            doc_file_path = get_doc_file_path(docs_dir, dir_path)
+            if is_documentation_up_to_date(doc_file_path, dir_info["mtime"]):
+                # Keep the cached response of skipped directories for later runs
+                if key in previous_cache:
+                    cache[key] = previous_cache[key]
+                log.info(
+                    f"✓ Documentation up to date for: {dir_path if dir_path else 'root'}"
+                )
+            elif key in previous_cache:
+                cache[key] = previous_cache[key]
+                try:
+                    save_documentation(docs_dir, dir_path, cache[key])
+                except OSError as e:
+                    log.error(
+                        f"✗ Failed to save documentation for: {dir_path if dir_path else 'root'} ({e})"
+                    )
+                    continue
+                log.info(
+                    f"✓ Documentation unchanged for: {dir_path if dir_path else 'root'}"
+                )
+            else:
+                keys[dir_path] = key
+                pending.append((dir_path, dir_info, prompt))
+
+        # Process the remaining directories in batches sharing one request each,
+        # concurrently over a single connection pool
+        semaphore = asyncio.Semaphore(parallel)
+        if pending:
+            async with create_client() as client:
+                # Load the model once so the concurrent requests don't race to load it
+                log.info("Loading model...")
+                if not await warm_up_model(client):
+                    # Report the unavailable server once instead of once per directory
+                    log.error(
+                        f"✗ Skipped generating documentation for {len(pending)} "
+                        "directories, Ollama is not available"
+                    )
+                    pending = []
+
+                tasks = [
+                    asyncio.create_task(
+                        process_batch(
+                            client,
+                            semaphore,
+                            docs_dir,
+                            pending[i : i + batch_size],
+                            root_dir_name,
+                        )
+                    )
+                    for i in range(0, len(pending), batch_size)
+                ]
+
+                # Save each batch as soon as it finishes while the others still generate
+                for task in asyncio.as_completed(tasks):
+                    for dir_path, documentation, streamed in await task:
+                        if not documentation:
+                            log.error(
+                                f"✗ Failed to generate documentation for: {dir_path if dir_path else 'root'}"
+                            )
+                            continue
+
+                        cache[keys[dir_path]] = documentation
+                        if not streamed:
+                            try:
+                                await asyncio.to_thread(
+                                    save_documentation,
+                                    docs_dir,
+                                    dir_path,
+                                    documentation,
+                                )
+                            except OSError as e:
+                                log.error(
+                                    f"✗ Failed to save documentation for: {dir_path if dir_path else 'root'} ({e})"
+                                )
+                                continue
+                        log.info(
+                            f"✓ Documentation generated for: {dir_path if dir_path else 'root'}"
+                        )
+    finally:
+        save_prompt_cache(cache_path, cache)
+
+    log.info(f"\nDocumentation generation complete! All files saved in {docs_dir}")
 
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
+    # Keep httpx from logging every request made by the Ollama client
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(main())
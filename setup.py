@@ -1,8 +1,57 @@
+import contextlib
+import logging
 import os
 import re
-import shutil
+import stat
+import sys
 from pathlib import Path
 
+log = logging.getLogger("local-helpers")
+
+# Matches a function definition (name(){ ... }) or an alias (name=value)
+ALIAS_RE = re.compile(
+    r"^(?:(?P<func>[^\s=()]+)\s*\(\)\{.*|(?P<name>[^=\s]+)\s*=\s*(?P<val>.*))$"
+)
+
+
+def get_write_target(path):
+    """Get the file to write through symlinks and the mode it should keep"""
+    # Write through symlinks (e.g. dotfile managers) and keep the file mode
+    path = os.path.realpath(path)
+    try:
+        return path, stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return path, 0o644
+
+
+def write_all(fd, data):
+    """Write all of data to the file descriptor"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def atomic_write_bytes(path, data, mode=None):
+    """Write data to path through a temporary file replaced in one step"""
+    path, current_mode = get_write_target(path)
+    if mode is None:
+        mode = current_mode
+
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        try:
+            write_all(fd, data)
+        finally:
+            os.close(fd)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Don't leave a partial temporary file behind
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
 
 class ShellConfigManager:
     def __init__(self):
@@ -10,18 +59,32 @@ class ShellConfigManager:
         self.bashrc_path = self.home_dir / ".bashrc"
         self.zshrc_path = self.home_dir / ".zshrc"
         self.script_dir = Path(__file__).parent
+        self._script_prefix = (
+            str(self.script_dir.resolve()).replace("\\", "/").rstrip("/") + "/"
+        )
         self.markers = {"start": "## local-helpers", "end": "## local-helpers"}
+        self._section_re = re.compile(
+            rf'{re.escape(self.markers["start"])}.*?{re.escape(self.markers["end"])}',
+            re.DOTALL,
+        )
 
         # Load aliases from alias.txt file
         self.aliases = self.load_aliases_from_file()
 
+        # Resolve the paths of script aliases once for all later lookups
+        self._resolved = {
+            alias_name: self.get_script_absolute_path(command)
+            for alias_name, command in self.aliases.items()
+            if command.endswith((".sh", ".py"))
+        }
+
     def load_aliases_from_file(self):
         """Load aliases from alias.txt file"""
         alias_file = self.script_dir / "alias.txt"
         aliases = {}
 
         if not alias_file.exists():
-            print(f"Warning: alias.txt file not found at {alias_file}")
+            log.warning(f"alias.txt file not found at {alias_file}")
             return aliases
 
         try:
@@ -29,51 +92,42 @@ class ShellConfigManager:
                 for line_number, line in enumerate(f, 1):
                     line = line.strip()
                     # Skip empty lines and comments
-                    if not line or line.startswith("#"):
+                    if not line or line[0] == "#":
                         continue
 
-                    # Handle function definitions (containing (){)
-                    if "(){" in line:
+                    match = ALIAS_RE.match(line)
+                    if not match:
+                        log.warning(
+                            f"Invalid alias format on line {line_number}: {line}"
+                        )
+                    elif match.group("func"):
                         # For function definitions, use the entire line as the command
-                        # Extract alias name (everything before (){)
-                        alias_name = line.split("(){", 1)[0].strip()
-                        aliases[alias_name] = line
-                    elif "=" in line:
-                        # Split on the first = only
-                        parts = line.split("=", 1)
-                        if len(parts) == 2:
-                            alias_name = parts[0].strip()
-                            command = parts[1].strip()
-                            # Remove surrounding quotes if present
-                            if (command.startswith('"') and command.endswith('"')) or (
-                                command.startswith("'") and command.endswith("'")
-                            ):
-                                command = command[1:-1]
-                            aliases[alias_name] = command
-                        else:
-                            print(
-                                f"Warning: Invalid alias format on line {line_number}: {line}"
-                            )
+                        aliases[match.group("func")] = line
                     else:
-                        print(
-                            f"Warning: Invalid alias format on line {line_number}: {line}"
-                        )
+                        command = match.group("val")
+                        # Remove surrounding quotes if present
+                        if (
+                            len(command) >= 2
+                            and command[0] in "\"'"
+                            and command[-1] == command[0]
+                        ):
+                            command = command[1:-1]
+                        aliases[match.group("name")] = command
 
         except Exception as e:
-            print(f"Error reading alias.txt: {e}")
+            log.error(f"Error reading alias.txt: {e}")
 
         # Validate that we loaded some aliases
         if not aliases:
-            print("Warning: No valid aliases found in alias.txt")
+            log.warning("No valid aliases found in alias.txt")
         else:
-            print(f"Loaded {len(aliases)} aliases from alias.txt")
+            log.info(f"Loaded {len(aliases)} aliases from alias.txt")
 
         return aliases
 
     def get_script_absolute_path(self, script_name):
         """Get the absolute path to a script in this repository"""
-        path = self.script_dir / script_name
-        return str(path).replace("\\", "/")
+        return self._script_prefix + script_name
 
     def generate_alias_content(self):
         """Generate the alias section content"""
@@ -87,17 +141,16 @@ class ShellConfigManager:
             if "(){" in command:
                 # For function definitions, use the complete definition
                 content.append(command)
+            # Check if command references a script file
+            elif command.endswith(".sh"):
+                content.append(f'alias {alias_name}="{self._resolved[alias_name]}"')
+            elif command.endswith(".py"):
+                content.append(
+                    f'alias {alias_name}="python3 {self._resolved[alias_name]}"'
+                )
             else:
-                # Check if command references a script file
-                if command.endswith(".sh") or command.endswith(".py"):
-                    script_path = self.get_script_absolute_path(command)
-                    if command.endswith(".sh"):
-                        content.append(f'alias {alias_name}="{script_path}"')
-                    elif command.endswith(".py"):
-                        content.append(f'alias {alias_name}="python3 {script_path}"')
-                else:
-                    # For regular commands, create an alias
-                    content.append(f'alias {alias_name}="{command}"')
+                # For regular commands, create an alias
+                content.append(f'alias {alias_name}="{command}"')
 
         content.append("")
         content.append(self.markers["end"])
@@ -105,43 +158,33 @@ class ShellConfigManager:
 
     def find_existing_section(self, content):
         """Find the existing local-helpers section in the content"""
-        pattern = re.compile(
-            rf'{re.escape(self.markers["start"])}.*?{re.escape(self.markers["end"])}',
-            re.DOTALL,
-        )
-        match = pattern.search(content)
-        return match
+        return self._section_re.search(content)
 
     def remove_existing_section(self, content):
         """Remove the existing local-helpers section"""
-        pattern = re.compile(
-            rf'{re.escape(self.markers["start"])}.*?{re.escape(self.markers["end"])}',
-            re.DOTALL,
-        )
-        return pattern.sub("", content).strip()
+        return self._section_re.sub("", content).strip()
 
-    def backup_file(self, file_path):
-        """Create a backup of the file"""
+    def backup_file(self, file_path, content):
+        """Create a backup of the file from its already read content"""
         backup_path = file_path.with_suffix(file_path.suffix + ".backup")
-        if file_path.exists():
-            shutil.copy2(file_path, backup_path)
-            print(f"Backup created: {backup_path}")
+        mode = stat.S_IMODE(file_path.stat().st_mode)
+        atomic_write_bytes(backup_path, content.encode("utf-8"), mode)
+        log.info(f"Backup created: {backup_path}")
 
     def update_shell_config(self, config_path):
         """Update a shell configuration file"""
         if not config_path.exists():
-            print(f"Creating new file: {config_path}")
+            log.info(f"Creating new file: {config_path}")
             config_path.touch()
 
-        # Read current content
-        current_content = config_path.read_text().strip()
-
-        # Backup the file
-        self.backup_file(config_path)
+        # Read current content and back it up without reading the file again
+        current_content = config_path.read_text()
+        self.backup_file(config_path, current_content)
+        current_content = current_content.strip()
 
         # Remove existing section if it exists
         if self.find_existing_section(current_content):
-            print(f"Removing existing local-helpers section from {config_path}")
+            log.info(f"Removing existing local-helpers section from {config_path}")
             new_content = self.remove_existing_section(current_content)
         else:
             new_content = current_content
@@ -154,92 +197,91 @@ class ShellConfigManager:
             new_content = alias_content
 
         # Write updated content
-        config_path.write_text(new_content)
-        print(f"Updated {config_path} with new aliases")
+        atomic_write_bytes(config_path, new_content.encode("utf-8"))
+        log.info(f"Updated {config_path} with new aliases")
 
     def verify_scripts_exist(self):
         """Verify that all scripts referenced in aliases exist"""
         missing_scripts = []
         for alias_name, command in self.aliases.items():
             # Only check for script files (ending with .sh or .py)
-            if command.endswith(".sh") or command.endswith(".py"):
+            if command.endswith((".sh", ".py")):
                 script_path = self.script_dir / command
                 if not script_path.exists():
                     missing_scripts.append(command)
 
         if missing_scripts:
-            print(
-                "Warning: The following scripts are referenced in aliases but were not found:"
+            log.warning(
+                "The following scripts are referenced in aliases but were not found:"
             )
             for script in missing_scripts:
-                print(f"  - {script}")
-            print("Aliases for these scripts will be created but may not work.")
+                log.warning(f"  - {script}")
+            log.warning("Aliases for these scripts will be created but may not work.")
 
         return len(missing_scripts) == 0
 
     def display_aliases(self):
         """Display the aliases that will be created"""
         if not self.aliases:
-            print("No aliases found in alias.txt")
+            log.info("No aliases found in alias.txt")
             return
 
-        print("Aliases to be created:")
+        log.info("Aliases to be created:")
         for alias_name, command in self.aliases.items():
             if "(){" in command:
-                print(f"  {alias_name}() (function)")
-            elif command.endswith(".sh") or command.endswith(".py"):
-                script_path = self.get_script_absolute_path(command)
-                if command.endswith(".sh"):
-                    print(f"  {alias_name} -> {script_path}")
-                elif command.endswith(".py"):
-                    print(f"  {alias_name} -> python3 {script_path}")
+                log.info(f"  {alias_name}() (function)")
+            elif command.endswith(".sh"):
+                log.info(f"  {alias_name} -> {self._resolved[alias_name]}")
+            elif command.endswith(".py"):
+                log.info(f"  {alias_name} -> python3 {self._resolved[alias_name]}")
             else:
-                print(f"  {alias_name} -> {command}")
+                log.info(f"  {alias_name} -> {command}")
 
     def run(self):
         """Main method to run the setup"""
-        print("Local Helpers Setup")
-        print("=" * 50)
+        log.info("Local Helpers Setup")
+        log.info("=" * 50)
 
         # Check if we have any aliases
         if not self.aliases:
-            print(
+            log.info(
                 "No aliases found in alias.txt. Please create an alias.txt file with your aliases."
             )
             return
 
         # Display what will be created
         self.display_aliases()
-        print()
+        log.info("")
 
         # Verify scripts exist
         all_scripts_exist = self.verify_scripts_exist()
         if not all_scripts_exist:
-            print()
+            log.info("")
 
         # Update shell configurations
-        print("Updating shell configurations...")
+        log.info("Updating shell configurations...")
 
         if self.bashrc_path.exists() or input("Create .bashrc? (y/n): ").lower() == "y":
             self.update_shell_config(self.bashrc_path)
-            print(f"Bash configuration updated")
+            log.info(f"Bash configuration updated")
         else:
-            print("Skipping .bashrc")
+            log.info("Skipping .bashrc")
 
         if self.zshrc_path.exists() or input("Create .zshrc? (y/n): ").lower() == "y":
             self.update_shell_config(self.zshrc_path)
-            print(f"Zsh configuration updated")
+            log.info(f"Zsh configuration updated")
         else:
-            print("Skipping .zshrc")
+            log.info("Skipping .zshrc")
 
-        print("\nSetup complete!")
-        print("\nTo use the new aliases, run:")
-        print("  source ~/.bashrc  # for bash")
-        print("  source ~/.zshrc   # for zsh")
-        print("\nOr restart your terminal.")
+        log.info("\nSetup complete!")
+        log.info("\nTo use the new aliases, run:")
+        log.info("  source ~/.bashrc  # for bash")
+        log.info("  source ~/.zshrc   # for zsh")
+        log.info("\nOr restart your terminal.")
 
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
     manager = ShellConfigManager()
     manager.run()
 